@@ -1,11 +1,17 @@
 import streamlit as st
-import plotly.express as px
 import plotly.graph_objects as go
-from plotly.subplots import make_subplots
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as pads
 import numpy as np
+import os
+import re
+import shutil
+import time
 from datetime import datetime, timedelta
-from data_fetcher import get_langsmith_data
+from data_fetcher import (
+    fetch_conversations, get_last_fetch_timestamp, save_last_fetch_timestamp, CACHE_DIR
+)
 
 # Configuration - Use Streamlit secrets
 API_KEY = st.secrets["LANGSMITH_API_KEY"]
@@ -71,60 +77,690 @@ st.markdown("""
 
 
 # ===== HELPER FUNCTIONS =====
+DAY_ORDER = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+STATUS_LABELS = ['❌ Failed', '✅ Success']
+
+# Conversation fields used by the dashboard. Nested fields (conversation_steps,
+# user_profile) are not displayed and are left out of the DataFrame.
+CONVERSATION_SCHEMA = pa.schema([
+    ('conversation_id', pa.string()),
+    ('user_id', pa.string()),
+    ('user_name', pa.string()),
+    ('run_name', pa.string()),
+    ('timestamp', pa.timestamp('us')),
+    ('conversation_length', pa.int64()),
+    ('program_recommended', pa.string()),
+    ('success', pa.bool_()),
+    ('total_tokens', pa.int64()),
+    ('latency_ms', pa.float64()),
+    ('user_input', pa.string()),
+    ('bot_response', pa.string()),
+    ('trace_url', pa.string()),
+])
+
+# Prepared conversations are persisted as one Parquet dataset per project, partitioned
+# by month, so a fresh process only fetches runs newer than the dataset's last fetch
+DATA_CACHE_TTL = 300
+DATASET_ROOT = os.path.join(CACHE_DIR, 'conversations')
+
+# Low-cardinality string columns stored as categoricals
+CATEGORY_COLUMNS = ('user_name', 'run_name', 'month', 'month_name', 'program_recommended')
+
+# Line charts with more points than this are downsampled with LTTB before plotting
+MAX_LINE_POINTS = 1500
+DOWNSAMPLED_POINTS = 1000
+
+# Usernames that are system-generated ("User-abc123"), UUID-like (long with 3+ hyphens)
+# or all hex characters once hyphens/underscores are dropped
+_NOT_REAL_NAME = re.compile(
+    r'^(?:User|Guest|user|guest)-'
+    r'|^(?=.{21,}\Z)(?:[^-]*-){3}'
+    r'|^[-_]*(?:[0-9a-fA-F][-_]*){17,}\Z',
+    re.DOTALL
+)
+
 def has_real_name(username):
     """Check if username appears to be a real name (not UUID or system-generated)"""
     if pd.isna(username) or username == 'Unknown' or username == '':
         return False
     
-    username_str = str(username).strip()
+    return _NOT_REAL_NAME.search(str(username).strip()) is None
+
+def real_name_mask(s: pd.Series) -> pd.Series:
+    """Vectorized has_real_name: boolean mask of usernames that look like real names"""
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        # Check each distinct name once and broadcast through the category codes
+        codes = s.cat.codes.to_numpy()
+        category_mask = np.append(real_name_mask(pd.Series(s.cat.categories)).to_numpy(), False)
+        return pd.Series(category_mask[codes], index=s.index)
     
-    # Check for system-generated patterns like "User-abc123" or "Guest-abc123"
-    if username_str.startswith(('User-', 'Guest-', 'user-', 'guest-')):
-        return False
+    s = s.astype('string')
+    notna = s.notna() & (s != '') & (s != 'Unknown')
+    s = s.str.strip()
     
-    # Check if it looks like a UUID (contains many hyphens and hex characters)
-    if len(username_str) > 20 and username_str.count('-') >= 3:
-        return False
+    # System-generated patterns like "User-abc123" or "Guest-abc123"
+    sys_gen = s.str.startswith(('User-', 'Guest-', 'user-', 'guest-'), na=False)
     
-    # Check if it's all hex characters (with or without hyphens)
-    cleaned = username_str.replace('-', '').replace('_', '')
-    if len(cleaned) > 16 and all(c in '0123456789abcdefABCDEF' for c in cleaned):
-        return False
+    # UUID-like (long with many hyphens)
+    uuidish = (s.str.len() > 20) & (s.str.count('-') >= 3)
+    
+    # All hex characters (with or without hyphens/underscores)
+    cleaned = s.str.replace('-', '', regex=False).str.replace('_', '', regex=False)
+    hexish = (cleaned.str.len() > 16) & cleaned.str.fullmatch(r'[0-9a-fA-F]+', na=False)
     
-    return True
+    return (notna & ~sys_gen & ~uuidish.fillna(False) & ~hexish.fillna(False)).astype(bool)
+
+def lttb_indices(y, n_out):
+    """Row positions kept by Largest-Triangle-Three-Buckets downsampling of y to n_out points"""
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+    
+    x = np.arange(n, dtype=float)
+    y = np.nan_to_num(y)
+    # First and last points are always kept; the rest is split into n_out - 2 buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    keep = np.empty(n_out, dtype=int)
+    keep[0], keep[-1] = 0, n - 1
+    
+    prev = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # Average of the next bucket (or the last point) is the third triangle vertex
+        nxt_lo, nxt_hi = hi, (edges[i + 2] if i + 2 < len(edges) else n)
+        avg_x, avg_y = x[nxt_lo:nxt_hi].mean(), y[nxt_lo:nxt_hi].mean()
+        area = np.abs((x[prev] - avg_x) * (y[lo:hi] - y[prev]) - (x[prev] - x[lo:hi]) * (avg_y - y[prev]))
+        prev = lo + int(np.argmax(area))
+        keep[i + 1] = prev
+    
+    return keep
 
 # ===== LOAD DATA =====
-@st.cache_data(ttl=300)
-def load_data(api_key, days, project_name, force_refresh=False):
-    """Load conversation data from LangSmith API"""
-    conversations = get_langsmith_data(api_key, days, project_name, force_full_refresh=force_refresh)
+def dataset_dir(project_name):
+    """Directory of the Parquet dataset for a LangSmith project"""
+    return os.path.join(DATASET_ROOT, re.sub(r'[^\w.-]', '_', str(project_name)))
+
+def clear_cached_data(project_name):
+    """Drop the in-memory Streamlit cache and the project's on-disk Parquet dataset (Force Refresh)"""
+    st.cache_data.clear()
+    shutil.rmtree(dataset_dir(project_name), ignore_errors=True)
+
+def write_dataset(df, path):
+    """Write prepared conversations to the Parquet dataset at path (one directory per month)
+    
+    Month partitions present in df replace the existing ones; other months are left alone.
+    Each month is a single part-0.parquet file.
+    """
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    pads.write_dataset(
+        table,
+        path,
+        format='parquet',
+        partitioning=['month'],
+        partitioning_flavor='hive',
+        basename_template='part-{i}.parquet',
+        existing_data_behavior='delete_matching',
+        file_options=pads.ParquetFileFormat().make_write_options(compression='zstd')
+    )
+
+def append_dataset(new_df, path):
+    """Merge new conversations into the dataset at path
+    
+    Each month the new rows fall in is read back, extended and rewritten, so every
+    partition stays a single file however many refreshes append to it. A re-fetched run
+    lands in the same month as its stored copy, so it is dropped against that read.
+    
+    The merged months are written to a staging directory first and each file is moved
+    over the live one with os.replace, so an interrupted append never loses a month.
+    """
+    months = new_df['month'].unique().tolist()
+    existing = pd.read_parquet(path, engine='pyarrow', filters=[('month', 'in', months)])
+    new_df = new_df[~new_df['conversation_id'].isin(existing['conversation_id'])]
+    if len(new_df) == 0:
+        return
+    merged = pd.concat([existing, new_df], ignore_index=True)
+    
+    # concat falls back to object for categoricals whose categories differ
+    for col in CATEGORY_COLUMNS:
+        merged[col] = merged[col].astype('category')
+    merged['day_of_week'] = pd.Categorical(merged['day_of_week'], categories=DAY_ORDER, ordered=True)
+    merged['status'] = pd.Categorical(merged['status'], categories=STATUS_LABELS)
+    
+    staging = f'{path}~staging'
+    shutil.rmtree(staging, ignore_errors=True)
+    write_dataset(merged, staging)
+    
+    for partition in os.listdir(staging):
+        target = os.path.join(path, partition)
+        os.makedirs(target, exist_ok=True)
+        staged_files = os.listdir(os.path.join(staging, partition))
+        for name in staged_files:
+            os.replace(os.path.join(staging, partition, name), os.path.join(target, name))
+        # Files from before the fixed part-0 name are now merged into it
+        for name in set(os.listdir(target)) - set(staged_files):
+            os.remove(os.path.join(target, name))
+    
+    shutil.rmtree(staging, ignore_errors=True)
+
+def prepare_dataframe(conversations):
+    """Build the dashboard DataFrame from fetched conversations"""
+    # Convert to DataFrame columnarly through Arrow (timestamps and success arrive typed).
+    # String columns stay Arrow-backed; numeric/bool/datetime columns are NumPy for the
+    # mask and bincount code below.
+    table = pa.Table.from_pylist(conversations, schema=CONVERSATION_SCHEMA)
+    df = table.to_pandas(split_blocks=True, self_destruct=True, types_mapper={pa.string(): pd.StringDtype('pyarrow')}.get)
+    del table
+    
+    df['date'] = df['timestamp'].dt.floor('D')
+    
+    # Calendar fields (computed once here so they are cached with the data)
+    df['month'] = df['timestamp'].dt.to_period('M').astype(str)
+    df['week'] = df['timestamp'].dt.isocalendar().week
+    df['month_name'] = df['timestamp'].dt.strftime('%B')
+    df['year'] = df['timestamp'].dt.year.astype('int16')
+    df['day_of_week'] = pd.Categorical(df['timestamp'].dt.day_name(), categories=DAY_ORDER, ordered=True)
+    df['hour'] = df['timestamp'].dt.hour.astype('int8')
     
-    if not conversations:
-        st.error("No conversations found!")
-        st.stop()
+    # Convert latency from ms to seconds
+    df['latency_seconds'] = df['latency_ms'] / 1000
     
-    # Convert to DataFrame
-    df = pd.DataFrame(conversations)
+    # Add status field (success used directly as the category code)
+    df['status'] = pd.Categorical.from_codes(df['success'].to_numpy().astype(np.int8), categories=STATUS_LABELS)
     
-    # Convert timestamps
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
-    df['date'] = pd.to_datetime(df['timestamp'].dt.date)
+    # Low-cardinality string columns as categoricals (smaller, faster groupby/isin)
+    for col in CATEGORY_COLUMNS:
+        df[col] = df[col].astype('category')
+    
+    return df
+
+@st.cache_data(ttl=DATA_CACHE_TTL)
+def load_data(api_key, days, project_name, force_refresh=False, _fetch_now=False):
+    """Load conversation data from LangSmith API
+    
+    Returns (df, real_usernames) where real_usernames is the sorted list of users
+    with real names, used for the user filter. _fetch_now (not part of the cache key)
+    runs the incremental fetch even if the dataset was updated within DATA_CACHE_TTL.
+    """
+    df = None
+    path = dataset_dir(project_name)
+    timestamp_file = os.path.join(path, '_last_fetch.json')
+    last_fetch = None if force_refresh else get_last_fetch_timestamp(timestamp_file)
+    
+    # Reuse the on-disk dataset, appending only runs started since its last fetch
+    if last_fetch is not None:
+        if _fetch_now or time.time() - os.path.getmtime(timestamp_file) >= DATA_CACHE_TTL:
+            try:
+                # 1 minute overlap to avoid gaps
+                start_time = last_fetch - timedelta(minutes=1)
+                end_time = datetime.now()
+                new_conversations = fetch_conversations(api_key, project_name, start_time, end_time)
+                
+                if new_conversations:
+                    append_dataset(prepare_dataframe(new_conversations), path)
+                
+                save_last_fetch_timestamp(end_time, timestamp_file)
+            except Exception as e:
+                # Keep showing the stored data; the next load retries from the same timestamp
+                st.warning(f"⚠️ Could not fetch new conversations, showing cached data: {str(e)}")
+        
+        try:
+            df = pd.read_parquet(path, engine='pyarrow')
+        except Exception:
+            df = None
+    
+    # No dataset for this project, or it can't be read: fetch the full window
+    if df is None:
+        end_time = datetime.now()
+        conversations = fetch_conversations(api_key, project_name, end_time - timedelta(days=days), end_time)
+        
+        if not conversations:
+            st.error("No conversations found!")
+            st.stop()
+        
+        df = prepare_dataframe(conversations)
+        
+        try:
+            shutil.rmtree(path, ignore_errors=True)
+            write_dataset(df, path)
+            save_last_fetch_timestamp(end_time, timestamp_file)
+        except Exception:
+            pass
     
-    # Use user_name from the data (which comes from run.name or generated)
-    # The data_fetcher should be updated to extract proper usernames
-    if 'user_name' not in df.columns:
-        df['user_name'] = df.get('user_id', 'Unknown')
+    # Sorted by time so filter_data can binary-search the date range
+    df = df.sort_values('timestamp', kind='stable', ignore_index=True)
     
-    # Ensure success is boolean
-    df['success'] = df['success'].astype(bool)
+    # Version stamp so derived caches below can skip hashing the whole DataFrame
+    df.attrs['version'] = datetime.now().timestamp()
     
-    # Convert latency from ms to seconds
-    df['latency_seconds'] = df['latency_ms'] / 1000 if 'latency_ms' in df.columns else 0
+    # Categories are already unique and non-null (but unsorted when read back from several files)
+    real_usernames = sorted(user for user in df['user_name'].cat.categories if has_real_name(user))
     
-    # Add status field
-    df['status'] = df['success'].apply(lambda x: '✅ Success' if x else '❌ Failed')
+    return df, real_usernames
+
+# ===== FILTERING =====
+# Row-level frames are recomputed on every rerun: the slice and masks take a few ms, while a
+# st.cache_data hit would unpickle a full copy of the rows each time.
+def filter_data(df, date_bounds, users, success_filter):
+    """Apply the dashboard filters to the loaded data (which load_data sorts by timestamp)"""
+    # Date filter: binary search for the row range on the sorted dates
+    if date_bounds is not None:
+        dates = df['date'].to_numpy()
+        start_date, end_date = (pd.to_datetime(d).to_datetime64().astype(dates.dtype) for d in date_bounds)
+        df = df.iloc[np.searchsorted(dates, start_date, side='left'):np.searchsorted(dates, end_date, side='right')]
+    
+    # Combine the remaining filters into one mask over the date slice and index once
+    mask = np.ones(len(df), dtype=bool)
     
-    return df
+    if success_filter == 'Successful':
+        mask &= df['success'].to_numpy()
+    elif success_filter == 'Failed':
+        mask &= ~df['success'].to_numpy()
+    
+    if 'All' not in users:
+        # Membership test on the integer category codes instead of hashing each name
+        user_names = df['user_name'].array
+        selected_codes = user_names.categories.get_indexer(list(users))
+        mask &= np.isin(user_names.codes, selected_codes[selected_codes >= 0])
+    
+    return df.iloc[mask]
+
+def real_user_rows(filtered_df):
+    """Rows of the filtered data whose user has a real name"""
+    return filtered_df[real_name_mask(filtered_df['user_name']).to_numpy()]
+
+# ===== CACHED DERIVATIONS =====
+# Streamlit reruns the whole script on every widget interaction. These small aggregates are
+# keyed on the data version plus the filter values; the DataFrame arguments are underscored
+# so they are not hashed.
+@st.cache_data(max_entries=50)
+def compute_metrics(_filtered_df, filter_key):
+    """Key metric card values, computed together from the underlying arrays
+    
+    Returns (total, successful, success rate %, avg latency s, unique users, slow traces).
+    """
+    success = _filtered_df['success'].to_numpy()
+    latency = _filtered_df['latency_seconds'].to_numpy(dtype=float, na_value=np.nan)
+    user_codes = _filtered_df['user_name'].cat.codes.to_numpy()
+    n_users = len(_filtered_df['user_name'].cat.categories)
+    
+    total_conversations = len(success)
+    successful_conversations = int(np.count_nonzero(success))
+    success_rate = (successful_conversations / total_conversations * 100) if total_conversations > 0 else 0
+    
+    has_latency = ~np.isnan(latency)
+    avg_response_time = latency[has_latency].mean() if has_latency.any() else np.nan
+    slow_traces = int(np.count_nonzero(latency > 15))
+    
+    # Seen-mask over category codes (-1 is a missing name)
+    unique_users = int(np.count_nonzero(np.bincount(user_codes[user_codes >= 0], minlength=n_users)))
+    
+    return total_conversations, successful_conversations, success_rate, avg_response_time, unique_users, slow_traces
+
+@st.cache_data(max_entries=50)
+def compute_daily_totals(_filtered_df, filter_key):
+    """Per-day conversation, success and latency totals
+    
+    The only pass over the filtered rows for Sections 1 and 2; every time series
+    and the daily latency chart are derived from these few hundred rows.
+    Latency NaNs are left out of the sum and count, like groupby mean.
+    """
+    codes, days = pd.factorize(_filtered_df['date'], sort=True)
+    latency = _filtered_df['latency_seconds'].to_numpy(dtype=float)
+    has_latency = ~np.isnan(latency)
+    
+    return pd.DataFrame({
+        'conversations': np.bincount(codes, minlength=len(days)),
+        'successes': np.bincount(codes, weights=_filtered_df['success'].to_numpy(dtype=float), minlength=len(days)),
+        'latency_sum': np.bincount(codes, weights=np.where(has_latency, latency, 0.0), minlength=len(days)),
+        'latency_count': np.bincount(codes, weights=has_latency, minlength=len(days))
+    }, index=days)
+
+@st.cache_data(max_entries=50)
+def compute_all_time_series(_filtered_df, filter_key):
+    """Conversation count and success rate per day, week and month
+    
+    Weeks and months roll up the cached daily totals, so switching the
+    View By radio only picks a precomputed frame.
+    """
+    totals = compute_daily_totals(_filtered_df, filter_key)
+    days = totals.index
+    daily_conversations = totals['conversations'].to_numpy()
+    daily_successes = totals['successes'].to_numpy()
+    
+    def roll_up(period_codes, n_periods):
+        conversations = np.bincount(period_codes, weights=daily_conversations, minlength=n_periods).astype(np.int64)
+        successes = np.bincount(period_codes, weights=daily_successes, minlength=n_periods)
+        return conversations, successes / conversations * 100
+    
+    daily = pd.DataFrame({
+        'date': days,
+        'conversations': daily_conversations,
+        'success_rate': daily_successes / daily_conversations * 100
+    })
+    
+    # Single integer ISO week key (year * 54 + week) instead of a two-column group key
+    iso = days.isocalendar()
+    iso_key = iso['year'].to_numpy(dtype=np.int64) * 54 + iso['week'].to_numpy(dtype=np.int64)
+    week_codes, weeks = pd.factorize(iso_key, sort=True)
+    conversations, success_rate = roll_up(week_codes, len(weeks))
+    weekly = pd.DataFrame({
+        'year': weeks // 54,
+        'week': weeks % 54,
+        'conversations': conversations,
+        'success_rate': success_rate
+    })
+    weekly['date'] = weekly['year'].astype(str) + '-W' + weekly['week'].astype(str)
+    
+    month_codes, months = pd.factorize(days.to_period('M'), sort=True)
+    conversations, success_rate = roll_up(month_codes, len(months))
+    monthly = pd.DataFrame({'date': months.astype(str), 'conversations': conversations, 'success_rate': success_rate})
+    
+    return {'Daily': daily, 'Weekly': weekly, 'Monthly': monthly}
+
+@st.cache_data(max_entries=50)
+def compute_daily_latency(_filtered_df, filter_key):
+    """Average response time per day"""
+    totals = compute_daily_totals(_filtered_df, filter_key)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        avg_latency = totals['latency_sum'].to_numpy() / totals['latency_count'].to_numpy()
+    return pd.DataFrame({'date': totals.index, 'avg_latency': avg_latency})
+
+@st.cache_data(max_entries=50)
+def compute_latency_histogram(_filtered_df, filter_key, bins=30):
+    """Response-time histogram binned server-side: (bin centers, bin widths, counts)"""
+    latency = _filtered_df['latency_seconds'].to_numpy(dtype=float, na_value=np.nan)
+    latency = latency[~np.isnan(latency)]
+    counts, edges = np.histogram(latency, bins=bins)
+    return (edges[:-1] + edges[1:]) / 2, np.diff(edges), counts
+
+@st.cache_data(max_entries=50)
+def compute_top_users(_real_users_df, filter_key):
+    """Top 10 real-name users by conversation count"""
+    top_users = _real_users_df.groupby('user_name', observed=True).agg(
+        conversations=('conversation_id', 'size'),
+        success_rate=('success', 'mean'),
+        avg_response_time=('latency_seconds', 'mean')
+    ).reset_index()
+    top_users['success_rate'] *= 100
+    return top_users.nlargest(10, 'conversations')
+
+@st.cache_data(max_entries=50)
+def compute_recent(_real_users_df, filter_key):
+    """Table of the 30 most recent real-name conversations"""
+    # O(N) selection of the 30 newest rows on the int64 view, then sort only those
+    ts = _real_users_df['timestamp'].to_numpy().view('i8')
+    newest = np.argpartition(ts, -30)[-30:] if len(ts) > 30 else np.arange(len(ts))
+    newest = newest[np.argsort(ts[newest], kind='stable')[::-1]]
+    recent = _real_users_df.iloc[newest]
+    
+    # Raw values; st.dataframe formats them column-wise via column_config
+    return pd.DataFrame({
+        'Timestamp': recent['timestamp'].to_numpy(),
+        'User': recent['user_name'].to_numpy(),
+        'Bot Type': recent['run_name'].to_numpy(),
+        'Response Time': recent['latency_seconds'].to_numpy(dtype=float, na_value=np.nan),
+        'Success': recent['success'].to_numpy(),
+        'Status': recent['status'].to_numpy()
+    })
+
+# ===== SECTIONS =====
+# Each section renders from the cached derivations above. The time series is a fragment,
+# so flipping its View By radio reruns only that section instead of the whole dashboard.
+
+# ===== SECTION 1: Conversations Over Time =====
+@st.fragment
+def render_time_series(filtered_df, filter_key):
+    """Conversation counts and success rate, by the View By period"""
+    st.markdown("---")
+    st.header("📈 Conversations Over Time")
+    
+    col1, col2 = st.columns([3, 1])
+    
+    with col2:
+        time_agg = st.radio("View By", ["Daily", "Weekly", "Monthly"], horizontal=True)
+    
+    with col1:
+        try:
+            time_series = compute_all_time_series(filtered_df, filter_key)[time_agg]
+            if len(time_series) > MAX_LINE_POINTS:
+                time_series = time_series.iloc[lttb_indices(time_series['conversations'], DOWNSAMPLED_POINTS)]
+            
+            # Traces and layout as plain dicts in a single constructor call: one validation
+            # pass, and the secondary axis is declared directly instead of via make_subplots
+            fig = go.Figure(
+                data=[
+                    dict(
+                        type='bar',
+                        x=time_series['date'],
+                        y=time_series['conversations'],
+                        name="Conversations",
+                        marker_color='#667eea'
+                    ),
+                    dict(
+                        type='scattergl',
+                        x=time_series['date'],
+                        y=time_series['success_rate'],
+                        name="Success Rate (%)",
+                        line=dict(color='#10b981', width=3),
+                        mode='lines+markers',
+                        yaxis='y2'
+                    )
+                ],
+                layout=dict(
+                    template='plotly_white',
+                    height=400,
+                    hovermode='x unified',
+                    xaxis=dict(title_text="Date"),
+                    yaxis=dict(title_text="Number of Conversations"),
+                    yaxis2=dict(title_text="Success Rate (%)", overlaying='y', side='right')
+                )
+            )
+            
+            st.plotly_chart(fig, use_container_width=True)
+        except Exception as e:
+            st.error(f"Error creating time series chart: {str(e)}")
+
+# ===== SECTION 2: Response Time Analysis =====
+def render_response_times(filtered_df, filter_key):
+    """Latency histogram and daily average response time"""
+    st.markdown("---")
+    st.header("⚡ Response Time Analysis")
+    
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        st.subheader("Response Time Distribution")
+        try:
+            if 'latency_seconds' in filtered_df.columns and filtered_df['latency_seconds'].notna().any():
+                centers, widths, counts = compute_latency_histogram(filtered_df, filter_key)
+                fig = go.Figure(
+                    data=[dict(type='bar', x=centers, y=counts, width=widths, marker_color='#667eea')],
+                    layout=dict(
+                        template='plotly_white', height=350, showlegend=False, bargap=0,
+                        xaxis=dict(title_text="Response Time (seconds)"),
+                        yaxis=dict(title_text="count")
+                    )
+                )
+                st.plotly_chart(fig, use_container_width=True)
+            else:
+                st.info("No latency data available.")
+        except Exception as e:
+            st.error(f"Error creating response time distribution: {str(e)}")
+    
+    with col2:
+        st.subheader("Response Time Over Time")
+        try:
+            if 'latency_seconds' in filtered_df.columns and len(filtered_df) > 0:
+                daily_latency = compute_daily_latency(filtered_df, filter_key)
+                if len(daily_latency) > MAX_LINE_POINTS:
+                    daily_latency = daily_latency.iloc[lttb_indices(daily_latency['avg_latency'], DOWNSAMPLED_POINTS)]
+                
+                fig = go.Figure(
+                    data=[dict(
+                        type='scattergl',
+                        x=daily_latency['date'],
+                        y=daily_latency['avg_latency'],
+                        mode='lines+markers',
+                        line=dict(color='#f59e0b', width=3)
+                    )],
+                    layout=dict(
+                        template='plotly_white', height=350,
+                        xaxis=dict(title_text="Date"),
+                        yaxis=dict(title_text="Avg Response Time (s)")
+                    )
+                )
+                st.plotly_chart(fig, use_container_width=True)
+            else:
+                st.info("No latency data available.")
+        except Exception as e:
+            st.error(f"Error creating response time chart: {str(e)}")
+
+# ===== SECTION 3: Most Active Users =====
+def render_top_users(real_users_df, filter_key):
+    """Top 10 real-name users by conversations, with stats for the top 5"""
+    st.markdown("---")
+    st.header("👥 Most Active Users")
+    
+    col1, col2 = st.columns([2, 1])
+    
+    with col1:
+        # Check if there are any users with real names
+        if len(real_users_df) == 0 or 'user_name' not in real_users_df.columns:
+            st.info("No users with real names found in the filtered data.")
+            top_users = pd.DataFrame(columns=['user_name', 'conversations', 'success_rate', 'avg_response_time'])
+        else:
+            top_users = compute_top_users(real_users_df, filter_key)
+        
+        if len(top_users) > 0:
+            fig = go.Figure(
+                data=[dict(
+                    type='bar',
+                    y=top_users['user_name'],
+                    x=top_users['conversations'],
+                    orientation='h',
+                    marker=dict(
+                        color=top_users['conversations'],
+                        colorscale='Viridis',
+                        showscale=True,
+                        colorbar=dict(title=dict(text="Number of Conversations"))
+                    )
+                )],
+                layout=dict(
+                    template='plotly_white', height=400, showlegend=False,
+                    xaxis=dict(title_text="Number of Conversations"),
+                    yaxis=dict(title_text="User")
+                )
+            )
+            st.plotly_chart(fig, use_container_width=True)
+        else:
+            st.info("No user data available to display.")
+    
+    with col2:
+        st.subheader("User Statistics")
+        try:
+            if len(top_users) > 0:
+                for _, user in top_users.head(5).iterrows():
+                    with st.expander(f"👤 {user['user_name']}"):
+                        st.metric("Conversations", f"{int(user['conversations'])}")
+                        st.metric("Success Rate", f"{user['success_rate']:.1f}%")
+                        st.metric("Avg Response", f"{user['avg_response_time']:.1f}s")
+            else:
+                st.info("No user statistics available.")
+        except Exception as e:
+            st.error(f"Error displaying user statistics: {str(e)}")
+
+# ===== SECTION 4: Usage Patterns =====
+def render_usage_patterns(filtered_df, filter_key):
+    """Conversations by day of week and by hour of day"""
+    st.markdown("---")
+    st.header("⏰ Usage Patterns")
+    
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        st.subheader("By Day of Week")
+        try:
+            if 'day_of_week' in filtered_df.columns and len(filtered_df) > 0:
+                day_counts = filtered_df['day_of_week'].value_counts(sort=False).reset_index()
+                day_counts.columns = ['day', 'count']
+                
+                fig = go.Figure(
+                    data=[dict(
+                        type='bar',
+                        x=day_counts['day'],
+                        y=day_counts['count'],
+                        marker=dict(
+                            color=day_counts['count'],
+                            colorscale='Blues',
+                            showscale=True,
+                            colorbar=dict(title=dict(text="Conversations"))
+                        )
+                    )],
+                    layout=dict(
+                        template='plotly_white', height=350, showlegend=False,
+                        xaxis=dict(title_text="Day of Week"),
+                        yaxis=dict(title_text="Conversations")
+                    )
+                )
+                st.plotly_chart(fig, use_container_width=True)
+            else:
+                st.info("No day of week data available.")
+        except Exception as e:
+            st.error(f"Error creating day of week chart: {str(e)}")
+    
+    with col2:
+        st.subheader("By Hour of Day")
+        try:
+            if 'hour' in filtered_df.columns and len(filtered_df) > 0:
+                hourly = filtered_df.groupby('hour').size().reset_index(name='count')
+                
+                fig = go.Figure(
+                    data=[dict(
+                        type='scatter',
+                        x=hourly['hour'],
+                        y=hourly['count'],
+                        mode='lines+markers',
+                        line=dict(color='#ef4444', width=3),
+                        marker=dict(size=10)
+                    )],
+                    layout=dict(
+                        template='plotly_white', height=350,
+                        xaxis=dict(title_text="Hour of Day"),
+                        yaxis=dict(title_text="Conversations")
+                    )
+                )
+                st.plotly_chart(fig, use_container_width=True)
+            else:
+                st.info("No hourly data available.")
+        except Exception as e:
+            st.error(f"Error creating hourly chart: {str(e)}")
+
+# ===== SECTION 5: Recent Activity =====
+def render_recent(real_users_df, filter_key):
+    """The 30 most recent conversations from real-name users"""
+    st.markdown("---")
+    st.header("💬 Recent Conversations")
+    
+    try:
+        if len(real_users_df) > 0:
+            display_df = compute_recent(real_users_df, filter_key)
+            
+            st.dataframe(
+                display_df,
+                use_container_width=True,
+                hide_index=True,
+                height=400,
+                column_config={
+                    'Timestamp': st.column_config.DatetimeColumn('Timestamp', format='YYYY-MM-DD HH:mm:ss'),
+                    'Response Time': st.column_config.NumberColumn('Response Time', format='%.2fs'),
+                    'Success': st.column_config.CheckboxColumn('Success')
+                }
+            )
+        else:
+            st.info("No recent conversations with real user names found.")
+    except Exception as e:
+        st.error(f"Error displaying recent conversations: {str(e)}")
 
 # ===== HEADER WITH REFRESH BUTTON =====
 col_title, col_refresh = st.columns([5, 1])
@@ -139,7 +775,7 @@ with col_title:
 with col_refresh:
     st.write("")  # Spacing
     if st.button("🔄 Force Refresh", help="Clear cache and fetch all data from scratch"):
-        st.cache_data.clear()
+        clear_cached_data(PROJECT_NAME)
         st.rerun()
 
 # Load data
@@ -148,20 +784,13 @@ try:
     days_to_load = 355
     
     with st.spinner("Loading conversation data from LangSmith..."):
-        df = load_data(API_KEY, days_to_load, PROJECT_NAME)
+        df, real_usernames = load_data(API_KEY, days_to_load, PROJECT_NAME,
+                                       _fetch_now=st.session_state.pop('fetch_now', False))
     
     if len(df) == 0:
         st.warning("No conversations found in the data.")
         st.stop()
     
-    # Add computed fields
-    df['month'] = df['timestamp'].dt.to_period('M').astype(str)
-    df['week'] = df['timestamp'].dt.isocalendar().week
-    df['month_name'] = df['timestamp'].dt.strftime('%B')
-    df['year'] = df['timestamp'].dt.year
-    df['day_of_week'] = df['timestamp'].dt.day_name()
-    df['hour'] = df['timestamp'].dt.hour
-    
     # ===== HORIZONTAL FILTERS =====
     st.markdown('<div class="filter-container">', unsafe_allow_html=True)
     st.subheader("🔍 Filters")
@@ -194,8 +823,7 @@ try:
     with col2:
         st.markdown("**👤 Users**")
         # Filter to only show users with real names (not generated usernames)
-        real_usernames = [user for user in df['user_name'].dropna().unique() if has_real_name(user)]
-        all_users = ['All'] + sorted(real_usernames)
+        all_users = ['All'] + real_usernames
         selected_users = st.multiselect("users", all_users, default=['All'], label_visibility="collapsed")
     
     with col3:
@@ -206,7 +834,9 @@ try:
     with col4:
         st.markdown("**🔄 Refresh**")
         if st.button("Refresh Data", use_container_width=True, help="Refresh dashboard with latest data"):
+            # Keep the on-disk dataset; the reload fetches only runs since its last fetch
             st.cache_data.clear()
+            st.session_state['fetch_now'] = True
             st.rerun()
     
     with col5:
@@ -223,40 +853,26 @@ try:
     st.markdown('</div>', unsafe_allow_html=True)
     
     # Apply filters
-    filtered_df = df.copy()
-    
-    # Date filter
-    if isinstance(date_range, tuple) and len(date_range) == 2:
-        start_date, end_date = date_range
-        start_date = pd.to_datetime(start_date)
-        end_date = pd.to_datetime(end_date)
-        filtered_df = filtered_df[(filtered_df['date'] >= start_date) & (filtered_df['date'] <= end_date)]
-    
-    if success_filter == 'Successful':
-        filtered_df = filtered_df[filtered_df['success'] == True]
-    elif success_filter == 'Failed':
-        filtered_df = filtered_df[filtered_df['success'] == False]
-    
-    if 'All' not in selected_users:
-        filtered_df = filtered_df[filtered_df['user_name'].isin(selected_users)]
+    date_bounds = tuple(date_range) if isinstance(date_range, tuple) and len(date_range) == 2 else None
+    filter_key = (df.attrs.get('version'), date_bounds, tuple(selected_users), success_filter)
+    filtered_df = filter_data(df, date_bounds, tuple(selected_users), success_filter)
     
     # Check if filtered data is empty
     if len(filtered_df) == 0:
         st.warning("⚠️ No data matches the selected filters. Please adjust your filter criteria.")
         st.stop()
     
+    # Users with real names (shared by Most Active Users and Recent Conversations)
+    real_users_df = real_user_rows(filtered_df)
+    
     # ===== KEY METRICS =====
     st.markdown("---")
     
     col1, col2, col3, col4, col5 = st.columns(5)
     
     try:
-        total_conversations = len(filtered_df)
-        successful_conversations = int(filtered_df['success'].sum())
-        success_rate = (successful_conversations / total_conversations * 100) if total_conversations > 0 else 0
-        avg_response_time = filtered_df['latency_seconds'].mean() if 'latency_seconds' in filtered_df.columns else 0
-        unique_users = filtered_df['user_name'].nunique() if 'user_name' in filtered_df.columns else 0
-        slow_traces = len(filtered_df[filtered_df['latency_seconds'] > 15]) if 'latency_seconds' in filtered_df.columns else 0
+        (total_conversations, successful_conversations, success_rate,
+         avg_response_time, unique_users, slow_traces) = compute_metrics(filtered_df, filter_key)
     except Exception as e:
         st.error(f"Error calculating metrics: {str(e)}")
         total_conversations = successful_conversations = success_rate = avg_response_time = unique_users = slow_traces = 0
@@ -301,268 +917,25 @@ try:
         </div>
         """, unsafe_allow_html=True)
     
-    # ===== SECTION 1: Conversations Over Time =====
-    st.markdown("---")
-    st.header("📈 Conversations Over Time")
-    
-    col1, col2 = st.columns([3, 1])
-    
-    with col2:
-        time_agg = st.radio("View By", ["Daily", "Weekly", "Monthly"], horizontal=True)
-    
-    with col1:
-        try:
-            if time_agg == "Daily":
-                time_series = filtered_df.groupby(filtered_df['date'].dt.date).agg({
-                    'conversation_id': 'count',
-                    'success': lambda x: (x.sum() / len(x) * 100) if len(x) > 0 else 0
-                }).reset_index()
-                time_series.columns = ['date', 'conversations', 'success_rate']
-            elif time_agg == "Weekly":
-                time_series = filtered_df.groupby([filtered_df['timestamp'].dt.isocalendar().year, 
-                                                   filtered_df['timestamp'].dt.isocalendar().week]).agg({
-                    'conversation_id': 'count',
-                    'success': lambda x: (x.sum() / len(x) * 100) if len(x) > 0 else 0
-                }).reset_index()
-                time_series.columns = ['year', 'week', 'conversations', 'success_rate']
-                time_series['date'] = time_series['year'].astype(str) + '-W' + time_series['week'].astype(str)
-            else:  # Monthly
-                time_series = filtered_df.groupby(filtered_df['timestamp'].dt.to_period('M')).agg({
-                    'conversation_id': 'count',
-                    'success': lambda x: (x.sum() / len(x) * 100) if len(x) > 0 else 0
-                }).reset_index()
-                time_series.columns = ['date', 'conversations', 'success_rate']
-                time_series['date'] = time_series['date'].astype(str)
-            
-            fig = make_subplots(specs=[[{"secondary_y": True}]])
-            
-            fig.add_trace(
-                go.Bar(
-                    x=time_series['date'],
-                    y=time_series['conversations'],
-                    name="Conversations",
-                    marker_color='#667eea'
-                ),
-                secondary_y=False,
-            )
-            
-            fig.add_trace(
-                go.Scatter(
-                    x=time_series['date'],
-                    y=time_series['success_rate'],
-                    name="Success Rate (%)",
-                    line=dict(color='#10b981', width=3),
-                    mode='lines+markers'
-                ),
-                secondary_y=True,
-            )
-            
-            fig.update_xaxes(title_text="Date")
-            fig.update_yaxes(title_text="Number of Conversations", secondary_y=False)
-            fig.update_yaxes(title_text="Success Rate (%)", secondary_y=True)
-            
-            fig.update_layout(
-                template='plotly_white',
-                height=400,
-                hovermode='x unified'
-            )
-            
-            st.plotly_chart(fig, use_container_width=True)
-        except Exception as e:
-            st.error(f"Error creating time series chart: {str(e)}")
-    
-    # ===== SECTION 2: Response Time Analysis =====
-    st.markdown("---")
-    st.header("⚡ Response Time Analysis")
-    
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        st.subheader("Response Time Distribution")
-        try:
-            if 'latency_seconds' in filtered_df.columns and len(filtered_df) > 0:
-                fig = px.histogram(
-                    filtered_df,
-                    x='latency_seconds',
-                    nbins=30,
-                    labels={'latency_seconds': 'Response Time (seconds)'},
-                    color_discrete_sequence=['#667eea']
-                )
-                fig.update_layout(template='plotly_white', height=350, showlegend=False)
-                st.plotly_chart(fig, use_container_width=True)
-            else:
-                st.info("No latency data available.")
-        except Exception as e:
-            st.error(f"Error creating response time distribution: {str(e)}")
-    
-    with col2:
-        st.subheader("Response Time Over Time")
-        try:
-            if 'latency_seconds' in filtered_df.columns and len(filtered_df) > 0:
-                daily_latency = filtered_df.groupby(filtered_df['date'].dt.date)['latency_seconds'].mean().reset_index()
-                daily_latency.columns = ['date', 'avg_latency']
-                
-                fig = px.line(
-                    daily_latency,
-                    x='date',
-                    y='avg_latency',
-                    labels={'avg_latency': 'Avg Response Time (s)', 'date': 'Date'},
-                    markers=True
-                )
-                fig.update_traces(line_color='#f59e0b', line_width=3)
-                fig.update_layout(template='plotly_white', height=350)
-                st.plotly_chart(fig, use_container_width=True)
-            else:
-                st.info("No latency data available.")
-        except Exception as e:
-            st.error(f"Error creating response time chart: {str(e)}")
-    
-    # ===== SECTION 3: Most Active Users =====
-    st.markdown("---")
-    st.header("👥 Most Active Users")
-    
-    col1, col2 = st.columns([2, 1])
-    
-    with col1:
-        # Filter to only users with real names
-        real_users_df = filtered_df[filtered_df['user_name'].apply(has_real_name)]
-        
-        # Check if there are any users with real names
-        if len(real_users_df) == 0 or 'user_name' not in real_users_df.columns:
-            st.info("No users with real names found in the filtered data.")
-            top_users = pd.DataFrame(columns=['user_name', 'conversations', 'success_rate', 'avg_response_time'])
-        else:
-            top_users = real_users_df.groupby('user_name').agg({
-                'conversation_id': 'count',
-                'success': lambda x: (x.sum() / len(x) * 100),
-                'latency_seconds': 'mean'
-            }).reset_index()
-            top_users.columns = ['user_name', 'conversations', 'success_rate', 'avg_response_time']
-            top_users = top_users.sort_values('conversations', ascending=False).head(10)
-        
-        if len(top_users) > 0:
-            fig = px.bar(
-                top_users,
-                y='user_name',
-                x='conversations',
-                orientation='h',
-                labels={'user_name': 'User', 'conversations': 'Number of Conversations'},
-                color='conversations',
-                color_continuous_scale='Viridis'
-            )
-            fig.update_layout(template='plotly_white', height=400, showlegend=False)
-            st.plotly_chart(fig, use_container_width=True)
-        else:
-            st.info("No user data available to display.")
-    
-    with col2:
-        st.subheader("User Statistics")
-        try:
-            if len(top_users) > 0:
-                for _, user in top_users.head(5).iterrows():
-                    with st.expander(f"👤 {user['user_name']}"):
-                        st.metric("Conversations", f"{int(user['conversations'])}")
-                        st.metric("Success Rate", f"{user['success_rate']:.1f}%")
-                        st.metric("Avg Response", f"{user['avg_response_time']:.1f}s")
-            else:
-                st.info("No user statistics available.")
-        except Exception as e:
-            st.error(f"Error displaying user statistics: {str(e)}")
-    
-    # ===== SECTION 4: Usage Patterns =====
-    st.markdown("---")
-    st.header("⏰ Usage Patterns")
-    
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        st.subheader("By Day of Week")
-        try:
-            if 'day_of_week' in filtered_df.columns and len(filtered_df) > 0:
-                day_order = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-                day_counts = filtered_df['day_of_week'].value_counts().reindex(day_order).reset_index()
-                day_counts.columns = ['day', 'count']
-                
-                fig = px.bar(
-                    day_counts,
-                    x='day',
-                    y='count',
-                    labels={'day': 'Day of Week', 'count': 'Conversations'},
-                    color='count',
-                    color_continuous_scale='Blues'
-                )
-                fig.update_layout(template='plotly_white', height=350, showlegend=False)
-                st.plotly_chart(fig, use_container_width=True)
-            else:
-                st.info("No day of week data available.")
-        except Exception as e:
-            st.error(f"Error creating day of week chart: {str(e)}")
-    
-    with col2:
-        st.subheader("By Hour of Day")
-        try:
-            if 'hour' in filtered_df.columns and len(filtered_df) > 0:
-                hourly = filtered_df.groupby('hour').size().reset_index(name='count')
-                
-                fig = px.line(
-                    hourly,
-                    x='hour',
-                    y='count',
-                    labels={'hour': 'Hour of Day', 'count': 'Conversations'},
-                    markers=True
-                )
-                fig.update_traces(line_color='#ef4444', marker_size=10, line_width=3)
-                fig.update_layout(template='plotly_white', height=350)
-                st.plotly_chart(fig, use_container_width=True)
-            else:
-                st.info("No hourly data available.")
-        except Exception as e:
-            st.error(f"Error creating hourly chart: {str(e)}")
-    
-    # ===== SECTION 5: Recent Activity =====
-    st.markdown("---")
-    st.header("💬 Recent Conversations")
-    
-    try:
-        # Filter to only users with real names
-        real_users_df = filtered_df[filtered_df['user_name'].apply(has_real_name)]
-        
-        if len(real_users_df) > 0:
-            recent = real_users_df.nlargest(30, 'timestamp')[
-                ['timestamp', 'user_name', 'run_name', 'latency_seconds', 'success', 'status']
-            ].copy()
-            
-            recent['Time'] = recent['timestamp'].dt.strftime('%Y-%m-%d %H:%M:%S')
-            recent['Success'] = recent['success'].apply(lambda x: '✅' if x else '❌')
-            recent['Response Time'] = recent['latency_seconds'].apply(lambda x: f"{x:.2f}s" if pd.notna(x) else 'N/A')
-            
-            display_df = recent[['Time', 'user_name', 'run_name', 'Response Time', 'Success', 'status']]
-            display_df.columns = ['Timestamp', 'User', 'Bot Type', 'Response Time', 'Success', 'Status']
-            
-            st.dataframe(display_df, use_container_width=True, hide_index=True, height=400)
-        else:
-            st.info("No recent conversations with real user names found.")
-    except Exception as e:
-        st.error(f"Error displaying recent conversations: {str(e)}")
+    render_time_series(filtered_df, filter_key)
+    render_response_times(filtered_df, filter_key)
+    render_top_users(real_users_df, filter_key)
+    render_usage_patterns(filtered_df, filter_key)
+    render_recent(real_users_df, filter_key)
     
     # ===== FOOTER =====
     st.markdown("---")
     
     try:
-        # Check if cache exists
-        import os
-        cache_dir = os.path.join(os.path.dirname(__file__), '.cache')
-        timestamp_file = os.path.join(cache_dir, 'last_fetch_timestamp.json')
+        # Check if this project's dataset exists (load_data stamps it after every fetch)
+        timestamp_file = os.path.join(dataset_dir(PROJECT_NAME), '_last_fetch.json')
         
         cache_info = ""
         if os.path.exists(timestamp_file):
-            import json
-            try:
-                with open(timestamp_file, 'r') as f:
-                    data = json.load(f)
-                    last_fetch = datetime.fromisoformat(data['last_fetch'])
-                    cache_info = f" | 🔄 Cache updated: {last_fetch.strftime('%Y-%m-%d %H:%M:%S')} | Next refresh: incremental"
-            except:
+            last_fetch = get_last_fetch_timestamp(timestamp_file)
+            if last_fetch is not None:
+                cache_info = f" | 🔄 Cache updated: {last_fetch.strftime('%Y-%m-%d %H:%M:%S')} | Next refresh: incremental"
+            else:
                 cache_info = " | 🔄 Using incremental updates"
         else:
             cache_info = " | 🔄 First run - building cache"
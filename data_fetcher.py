@@ -1,16 +1,16 @@
 """LangSmith data fetcher for counseling bot analytics."""
 
 from langsmith import Client
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
 from datetime import datetime, timedelta
 from typing import Optional, List, Dict, Any
 import json
 import os
-import pickle
+import re
 
 # Cache directory for persistent storage
 CACHE_DIR = os.path.join(os.path.dirname(__file__), '.cache')
-CACHE_FILE = os.path.join(CACHE_DIR, 'conversations_cache.pkl')
-TIMESTAMP_FILE = os.path.join(CACHE_DIR, 'last_fetch_timestamp.json')
 
 # Ensure cache directory exists
 os.makedirs(CACHE_DIR, exist_ok=True)
@@ -18,84 +18,100 @@ os.makedirs(CACHE_DIR, exist_ok=True)
 # Excluded usernames
 EXCLUDED_USERNAMES = {'Rawan_Youssif'}
 
+# User profile defaults, copied into each conversation's profile
+_DEFAULT_PROFILE = {
+    'age': None,
+    'education_level': 'Unknown',
+    'grades': None
+}
 
-def get_last_fetch_timestamp():
-    """Get the timestamp of the last successful fetch."""
-    if os.path.exists(TIMESTAMP_FILE):
+# Long fetch ranges are split into windows of this size and fetched concurrently
+FETCH_WINDOW = timedelta(days=7)
+FETCH_WORKERS = 8
+
+# Program keywords in priority order - the first listed keyword found in a response wins
+PROGRAM_KEYWORDS = [
+    ('engineering', 'Engineering'),
+    ('business', 'Business'),
+    ('medicine', 'Medicine'),
+    ('computer science', 'Computer Science'),
+    ('computing', 'Computer Science'),
+    ('arts', 'Arts'),
+    ('law', 'Law'),
+    ('science', 'Science'),
+]
+# Lookahead so overlapping keywords are all found in a single scan. Matched against the
+# lowercased response rather than with re.IGNORECASE, whose Unicode case folding also
+# matches strings like 'ſcience' that are not keywords.
+_PROGRAM_RE = re.compile('(?=(' + '|'.join(re.escape(k) for k, _ in PROGRAM_KEYWORDS) + '))')
+_PROGRAM_PRIORITY = {keyword: i for i, (keyword, _) in enumerate(PROGRAM_KEYWORDS)}
+_PROGRAM_NAMES = dict(PROGRAM_KEYWORDS)
+
+
+def classify_program(response: str) -> str:
+    """Map a bot response to the recommended program mentioned in it.
+    
+    >>> classify_program('Consider Computer Science or Law')
+    'Computer Science'
+    >>> classify_program('MEDİCİNE'), classify_program('ſcience degree')
+    ('General Counseling', 'General Counseling')
+    """
+    found = set(_PROGRAM_RE.findall(response.lower()))
+    if not found:
+        return 'General Counseling'
+    return _PROGRAM_NAMES[min(found, key=_PROGRAM_PRIORITY.__getitem__)]
+
+def get_last_fetch_timestamp(path: str):
+    """Get the timestamp of the last successful fetch recorded in path."""
+    if os.path.exists(path):
         try:
-            with open(TIMESTAMP_FILE, 'r') as f:
+            with open(path, 'r') as f:
                 data = json.load(f)
                 return datetime.fromisoformat(data['last_fetch'])
         except Exception:
             return None
     return None
 
-def save_last_fetch_timestamp(timestamp: datetime):
-    """Save the timestamp of the last successful fetch."""
-    with open(TIMESTAMP_FILE, 'w') as f:
+def save_last_fetch_timestamp(timestamp: datetime, path: str):
+    """Save the timestamp of the last successful fetch to path."""
+    with open(path, 'w') as f:
         json.dump({'last_fetch': timestamp.isoformat()}, f)
 
-def load_cached_conversations():
-    """Load cached conversations from disk and filter excluded usernames."""
-    if os.path.exists(CACHE_FILE):
-        try:
-            with open(CACHE_FILE, 'rb') as f:
-                conversations = pickle.load(f)
-                # Filter out excluded usernames
-                return [c for c in conversations if c.get('user_name') not in EXCLUDED_USERNAMES]
-        except Exception:
-            return []
-    return []
-
-def save_cached_conversations(conversations: List[Dict]):
-    """Save conversations to cache."""
-    with open(CACHE_FILE, 'wb') as f:
-        pickle.dump(conversations, f)
-
-def get_langsmith_data(api_key: str, days: int = 7, project_name: str = "counseling-bot-production", force_full_refresh: bool = False):
+def fetch_conversations(api_key: str, project_name: str, start_time: datetime, end_time: datetime) -> List[Dict]:
     """
-    Fetch conversation data from LangSmith traces with incremental updates.
+    Fetch and process root runs started between start_time and end_time.
     
-    Args:
-        api_key: LangSmith API key
-        days: Number of days to look back on first run (default 7)
-        project_name: LangSmith project name
-        force_full_refresh: If True, ignores cache and fetches all data from scratch
-    
-    Returns data in format:
-    {
-        "conversation_id": str,
-        "user_id": str,
-        "timestamp": datetime,
-        "conversation_steps": [steps],
-        "user_profile": dict,
-        "program_recommended": str,
-        "success": bool,
-        "total_tokens": int,
-        "latency_ms": float
-    }
+    Long ranges are split into FETCH_WINDOW-sized windows fetched concurrently
+    (the work is network-bound). Returns a list of conversation dicts (see
+    get_langsmith_data), skipping excluded usernames. Does not read or write
+    the local cache.
     """
-    client = Client(api_key=api_key)
+    windows = []
+    window_start = start_time
+    while window_start < end_time:
+        window_end = min(window_start + FETCH_WINDOW, end_time)
+        windows.append((window_start, window_end))
+        window_start = window_end
     
-    # Load existing cached conversations
-    if not force_full_refresh:
-        cached_conversations = load_cached_conversations()
-        last_fetch = get_last_fetch_timestamp()
-    else:
-        cached_conversations = []
-        last_fetch = None
+    if len(windows) <= 1:
+        return _fetch_window(api_key, project_name, start_time, end_time)
     
-    # Determine time range for fetching
-    end_time = datetime.now()
-    if last_fetch and not force_full_refresh:
-        # Fetch only new data since last fetch (with 1 minute overlap to avoid gaps)
-        start_time = last_fetch - timedelta(minutes=1)
-        print(f"📥 Fetching incremental data since {start_time.strftime('%Y-%m-%d %H:%M:%S')}...")
-    else:
-        # First run or forced refresh - fetch all data from the past N days
-        start_time = end_time - timedelta(days=days)
-        print(f"📥 Fetching full data for the last {days} days...")
+    with ThreadPoolExecutor(max_workers=min(FETCH_WORKERS, len(windows))) as executor:
+        results = executor.map(lambda window: _fetch_window(api_key, project_name, *window), windows)
+        
+        # Runs on a window boundary can be returned by both windows
+        conversations = []
+        seen_ids = set()
+        for conversation in chain.from_iterable(results):
+            if conversation['conversation_id'] not in seen_ids:
+                seen_ids.add(conversation['conversation_id'])
+                conversations.append(conversation)
     
+    return conversations
+
+def _fetch_window(api_key: str, project_name: str, start_time: datetime, end_time: datetime) -> List[Dict]:
+    """Fetch and process root runs for one time window (own Client per thread)."""
+    client = Client(api_key=api_key)
     new_conversations = []
     
     for run in client.list_runs(
@@ -108,34 +124,31 @@ def get_langsmith_data(api_key: str, days: int = 7, project_name: str = "counsel
         conversation_id = str(run.id)
         timestamp = run.start_time
         
-        # Extract user name/identifier - prefer actual name over UUID
-        user_name = None
-        user_id = None
-        run_name = None
+        # Read the optional run attributes once
+        extra = getattr(run, 'extra', None) or {}
+        inputs = getattr(run, 'inputs', None) or {}
+        outputs = getattr(run, 'outputs', None) or {}
         
-        # Try to get name from run attributes
-        if hasattr(run, 'name') and run.name:
-            run_name = run.name
-            # Don't use run.name as user_name since it's the bot/model name
+        # Don't use run.name as user_name since it's the bot/model name
+        run_name = getattr(run, 'name', None) or None
         
-        # Try to get from metadata and inputs
-        if hasattr(run, 'extra') and run.extra:
-            user_name = run.extra.get('name') or run.extra.get('username')
-            user_id = run.extra.get('user_id') or run.extra.get('session_id')
+        # Extract user name/identifier - prefer actual name over UUID
+        user_name = extra.get('name') or extra.get('username')
+        user_id = extra.get('user_id') or extra.get('session_id')
         
         # Try to get username from inputs (this is where actual user names are stored)
-        if hasattr(run, 'inputs') and run.inputs:
-            input_username = run.inputs.get('user_input_username') or run.inputs.get('username')
-            if input_username and not user_name:
-                user_name = str(input_username)
+        input_username = inputs.get('user_input_username') or inputs.get('username')
+        if input_username and not user_name:
+            user_name = str(input_username)
         
         # Skip excluded usernames (check early to avoid processing)
         if user_name and user_name in EXCLUDED_USERNAMES:
             continue
 
         # Try session_id
-        if not user_id and hasattr(run, 'session_id'):
-            user_id = str(run.session_id) if run.session_id else None
+        if not user_id:
+            session_id = getattr(run, 'session_id', None)
+            user_id = str(session_id) if session_id else None
         
         # Fallback to session-based name
         if not user_name:
@@ -155,28 +168,19 @@ def get_langsmith_data(api_key: str, days: int = 7, project_name: str = "counsel
             latency_ms = (run.end_time - run.start_time).total_seconds() * 1000
         
         # Extract tokens
-        total_tokens = None
-        if hasattr(run, 'extra') and run.extra:
-            usage = run.extra.get('usage', {})
-            total_tokens = usage.get('total_tokens')
+        total_tokens = extra.get('usage', {}).get('total_tokens') if extra else None
         
         # Extract input/output
         user_input = ''
         bot_response = ''
         
-        if hasattr(run, 'inputs') and run.inputs:
-            input_val = run.inputs.get('user_input')
-            if not input_val:
-                input_val = run.inputs.get('input')
-            if input_val is not None:
-                user_input = str(input_val) if not isinstance(input_val, str) else input_val
+        input_val = inputs.get('user_input') or inputs.get('input')
+        if input_val is not None:
+            user_input = str(input_val) if not isinstance(input_val, str) else input_val
         
-        if hasattr(run, 'outputs') and run.outputs:
-            output_val = run.outputs.get('output')
-            if not output_val:
-                output_val = run.outputs.get('response')
-            if output_val is not None:
-                bot_response = str(output_val) if not isinstance(output_val, str) else output_val
+        output_val = outputs.get('output') or outputs.get('response')
+        if output_val is not None:
+            bot_response = str(output_val) if not isinstance(output_val, str) else output_val
         
         # Build conversation steps (simplified - single step for now)
         conversation_steps = []
@@ -188,52 +192,27 @@ def get_langsmith_data(api_key: str, days: int = 7, project_name: str = "counsel
                 'confidence_score': 0.95  # Default high confidence
             })
         
-        # Extract user profile (mock data if not available)
-        user_profile = {
-            'age': None,
-            'education_level': 'Unknown',
-            'grades': None
-        }
-        
-        if hasattr(run, 'extra') and run.extra:
-            profile = run.extra.get('user_profile', {})
-            if profile:
-                user_profile.update(profile)
+        # Extract user profile (defaults if not available)
+        profile = extra.get('user_profile')
+        user_profile = {**_DEFAULT_PROFILE, **profile} if profile else dict(_DEFAULT_PROFILE)
         
         # Extract recommended program from output
-        program_recommended = None
+        # This is a simplified extraction - adjust based on your actual data
         if bot_response and isinstance(bot_response, str):
-            # Try to extract program mentions from response
-            # This is a simplified extraction - adjust based on your actual data
-            response_lower = bot_response.lower()
-            if 'engineering' in response_lower:
-                program_recommended = 'Engineering'
-            elif 'business' in response_lower:
-                program_recommended = 'Business'
-            elif 'medicine' in response_lower:
-                program_recommended = 'Medicine'
-            elif 'computer science' in response_lower or 'computing' in response_lower:
-                program_recommended = 'Computer Science'
-            elif 'arts' in response_lower:
-                program_recommended = 'Arts'
-            elif 'law' in response_lower:
-                program_recommended = 'Law'
-            elif 'science' in response_lower:
-                program_recommended = 'Science'
-            else:
-                program_recommended = 'General Counseling'
+            program_recommended = classify_program(bot_response)
         else:
             program_recommended = 'General Counseling'
         
-        # Determine success (ensure it's always boolean)
+        # Determine success (ensure it's always boolean); bot_response is always a str here
         is_success = bool(
             getattr(run, 'status', 'success') == 'success' and 
             not getattr(run, 'error', None) and 
-            bot_response and len(str(bot_response)) > 0
+            bot_response
         )
         
         # Build trace URL
-        trace_url = f"https://smith.langchain.com/o/{str(run.trace_id).split('-')[0] if hasattr(run, 'trace_id') and run.trace_id else ''}/projects/p/{project_name}/r/{conversation_id}"
+        trace_id = getattr(run, 'trace_id', None)
+        trace_url = f"https://smith.langchain.com/o/{str(trace_id).split('-')[0] if trace_id else ''}/projects/p/{project_name}/r/{conversation_id}"
         
         conversation = {
             'conversation_id': conversation_id,
@@ -255,27 +234,7 @@ def get_langsmith_data(api_key: str, days: int = 7, project_name: str = "counsel
         
         new_conversations.append(conversation)
     
-    # Merge new conversations with cached ones
-    if cached_conversations and not force_full_refresh:
-        # Create a set of existing conversation IDs
-        existing_ids = {conv['conversation_id'] for conv in cached_conversations}
-        
-        # Add only truly new conversations (not in cache)
-        truly_new = [conv for conv in new_conversations if conv['conversation_id'] not in existing_ids]
-        
-        # Combine cached + new
-        all_conversations = cached_conversations + truly_new
-        
-        print(f"✅ Retrieved {len(truly_new)} new conversations (total: {len(all_conversations)})")
-    else:
-        all_conversations = new_conversations
-        print(f"✅ Retrieved {len(all_conversations)} conversations")
-    
-    # Save to cache for next run
-    save_cached_conversations(all_conversations)
-    save_last_fetch_timestamp(end_time)
-    
-    return all_conversations
+    return new_conversations
 
 def calculate_cost(tokens: Optional[int], model: str = "gpt-4") -> float:
     """Calculate approximate cost based on tokens."""